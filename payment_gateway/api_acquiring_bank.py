@@ -12,6 +12,9 @@ from payment_gateway.transaction_format import TransactionFormat
 #                          BASE
 # ==============================================================
 
+# Name of the bank of acquiring_bank_api_url and acquiring_bank_api_key in config.yml
+DEFAULT_ACQUIRER = "default"
+
 
 class APIAcquiringBank:
     """ This class handle the call to the API Acquiring Bank
@@ -20,21 +23,34 @@ class APIAcquiringBank:
         self.acquiring_bank_api_key = load_config().get("acquiring_bank_api_key")
         self.acquiring_bank_api_url = load_config().get("acquiring_bank_api_url")
         self.acquiring_bank_test_mode = load_config().get("acquiring_bank_test_mode")
+        self.acquiring_banks = load_config().get("acquiring_banks") or {}
 
-    def call_acquiring_bank(self, payment_data: TransactionFormat):
+    def call_acquiring_bank(self, payment_data: TransactionFormat, acquirer: str = None):
         """ Method to decide whether the mock should be called
             or not accoridng to the config.yml file
+            The acquirer is the one selected by the BIN table, the default bank is used if None
         """
         if self.acquiring_bank_test_mode is True:
             return self.call_acquiring_bank_mock(payment_data)
         else:
-            return self.call_acquiring_bank_real(payment_data)
+            return self.call_acquiring_bank_real(payment_data, acquirer)
+
+    def get_acquiring_bank(self, acquirer: str = None) -> tuple:
+        """ Method to get the (api url, api key) of an acquirer
+        """
+        if acquirer is None or acquirer == DEFAULT_ACQUIRER:
+            return self.acquiring_bank_api_url, self.acquiring_bank_api_key
+        if acquirer not in self.acquiring_banks:
+            raise ValueError(f"Unknown acquiring bank '{acquirer}'")
+        acquiring_bank = self.acquiring_banks[acquirer]
+        return acquiring_bank.get("api_url"), acquiring_bank.get("api_key")
 
-    def call_acquiring_bank_real(self, payment_data: TransactionFormat):
+    def call_acquiring_bank_real(self, payment_data: TransactionFormat, acquirer: str = None):
         """ Method to call Acquiring Bank API
             the build of api_bank_url variable is only an example
         """
-        api_bank_url = self.acquiring_bank_api_url + "&appid=" + self.acquiring_bank_api_url
+        api_url, api_key = self.get_acquiring_bank(acquirer)
+        api_bank_url = api_url + "&appid=" + api_key
         response_api_bank = requests.get(api_bank_url, json=payment_data)
 
         return response_api_bank.json
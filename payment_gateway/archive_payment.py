@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# ==============================================================
+#                         IMPORTS
+# ==============================================================
+import os
+import json
+import mmap
+import fcntl
+import bisect
+import itertools
+import zlib
+import time
+import struct
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from payment_gateway.config import load_config
+from payment_gateway.database import CardInformation, PaymentStatus
+
+# ==============================================================
+#                          BASE
+# ==============================================================
+
+# Each index entry is (payment id, offset in segment, compressed record length)
+INDEX_ENTRY = struct.Struct("<QQI")
+
+SEGMENT_PREFIX = "segment_"
+SEGMENT_DATA_EXTENSION = ".dat"
+SEGMENT_INDEX_EXTENSION = ".idx"
+
+# Locked by the archive run writing to the archive directory
+LOCK_FILE = "lock"
+
+# Segments are never modified once their index exists, so their id ranges are cached:
+# archive directory -> (directory mtime, first payment ids, highest last payment id up to
+# each segment, segments), where segments are (first payment id, last payment id, path)
+# sorted by first payment id
+segment_cache = {}
+# Memory-mapped indexes of the last used segments, each one keeps a file descriptor open:
+# index path -> index map, least recently used first
+index_map_cache = OrderedDict()
+segment_cache_lock = threading.Lock()
+RECENT_MTIME_NS = 1_000_000_000
+
+
+class ArchivePayment:
+    """ Class to move old payments out of the database into compressed segment files.
+        Each archive run writes one append-only segment (.dat) holding one zlib
+        compressed record per payment, and a sorted id -> offset index (.idx)
+        so that a payment can be read back with a single seek.
+        Payments are read and deleted by batches of archive_batch_size.
+    """
+    def __init__(self, db_session: Session, archive_directory: str = None, archive_threshold_days: int = None,
+                 archive_batch_size: int = None):
+        config = load_config()
+        self.db_session = db_session
+        self.archive_directory = archive_directory or config.get("archive_directory")
+        if archive_threshold_days is None:
+            archive_threshold_days = config.get("archive_threshold_days")
+        self.archive_threshold_days = archive_threshold_days
+        self.archive_batch_size = archive_batch_size or config.get("archive_batch_size")
+        self.archive_cached_segments = config.get("archive_cached_segments")
+        self.logger = logging.getLogger(__name__)
+
+    def list_segments(self) -> list:
+        """ Return the path of every segment, without extension, sorted by creation order
+        """
+        if not os.path.isdir(self.archive_directory):
+            return []
+        segment_names = sorted(
+            file_name[:-len(SEGMENT_INDEX_EXTENSION)]
+            for file_name in os.listdir(self.archive_directory)
+            if file_name.startswith(SEGMENT_PREFIX) and file_name.endswith(SEGMENT_INDEX_EXTENSION)
+        )
+        return [os.path.join(self.archive_directory, segment_name) for segment_name in segment_names]
+
+    def lock_directory(self) -> int:
+        """ Prevent two archive runs from writing to the archive directory at the same time.
+            Return the file descriptor holding the lock.
+        """
+        lock_fd = os.open(os.path.join(self.archive_directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(lock_fd)
+            raise RuntimeError(f"Archive directory {self.archive_directory} is used by another archive run")
+        return lock_fd
+
+    def sync_directory(self):
+        """ Make durable the files created or renamed in the archive directory
+        """
+        directory_fd = os.open(self.archive_directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def archive_payments(self) -> int:
+        """ Move the payments older than the threshold to a new segment.
+            The segment is written and synced before rows are deleted, so a crash
+            can only leave a payment in both places, never in none.
+            Return the number of archived payments.
+        """
+        os.makedirs(self.archive_directory, exist_ok=True)
+        lock_fd = self.lock_directory()
+        try:
+            threshold_date = datetime.datetime.utcnow() - datetime.timedelta(days=self.archive_threshold_days)
+            segment_path = self.write_segment(self.read_old_payments(threshold_date))
+            if segment_path is None:
+                return 0
+            return self.delete_archived_payments(segment_path)
+        finally:
+            os.close(lock_fd)
+
+    def read_old_payments(self, threshold_date: datetime.datetime):
+        """ Yield the (payment id, record) of the payments created before threshold_date,
+            by increasing id. Payments are read by batches of archive_batch_size.
+        """
+        last_archived_id = 0
+        while True:
+            old_payments = (
+                self.db_session.query(PaymentStatus, CardInformation)
+                .join(CardInformation, PaymentStatus.card_id == CardInformation.id)
+                .filter(PaymentStatus.created_at < threshold_date, PaymentStatus.id > last_archived_id)
+                .order_by(PaymentStatus.id)
+                .limit(self.archive_batch_size)
+                .all()
+            )
+            if not old_payments:
+                return
+            last_archived_id = old_payments[-1][0].id
+            for payment, card_information in old_payments:
+                yield payment.id, {
+                    "payment_id": payment.id,
+                    "status_code": payment.status,
+                    "message": payment.message,
+                    "amount": payment.amount,
+                    "currency": payment.currency,
+                    "card_owner": card_information.owner_name,
+                    "card_number": card_information.card_number,
+                    "expiration_date": card_information.expiration_date,
+                    "ccv": card_information.ccv,
+                    "card_brand": card_information.brand,
+                    "created_at": payment.created_at.isoformat(),
+                }
+
+    def delete_archived_payments(self, segment_path: str) -> int:
+        """ Delete the payments of a segment from the database, by batches of archive_batch_size.
+            Cards are kept: a payment being stored may already have looked up their id.
+            Return the number of deleted payments.
+        """
+        deleted_count = 0
+        with open(segment_path + SEGMENT_INDEX_EXTENSION, "rb") as index_file:
+            while True:
+                index_entries = index_file.read(self.archive_batch_size * INDEX_ENTRY.size)
+                if not index_entries:
+                    return deleted_count
+                archived_ids = [payment_id for payment_id, _, _ in INDEX_ENTRY.iter_unpack(index_entries)]
+                try:
+                    self.db_session.query(PaymentStatus).filter(
+                        PaymentStatus.id.in_(archived_ids)
+                    ).delete(synchronize_session=False)
+                    self.db_session.commit()
+                except Exception as e:
+                    self.db_session.rollback()
+                    self.logger.error(f"Error while archiving payments: {e}")
+                    raise
+                deleted_count += len(archived_ids)
+
+    def next_segment_path(self) -> str:
+        """ Return the path of a new segment, without extension. It is numbered after
+            every segment file, including the data file left by an interrupted run.
+        """
+        segment_numbers = [
+            int(file_name[len(SEGMENT_PREFIX):].split(".")[0])
+            for file_name in os.listdir(self.archive_directory)
+            if file_name.startswith(SEGMENT_PREFIX)
+        ]
+        return os.path.join(self.archive_directory, f"{SEGMENT_PREFIX}{max(segment_numbers, default=-1) + 1:08d}")
+
+    def write_segment(self, records) -> str:
+        """ Write the (payment id, record) given by increasing payment id to a new segment
+            and its index. Must be called with the archive directory locked.
+            Return the path of the segment, without extension, or None if there is no record.
+        """
+        segment_path = self.next_segment_path()
+        temporary_index_path = segment_path + SEGMENT_INDEX_EXTENSION + ".tmp"
+
+        records_count = 0
+        with open(segment_path + SEGMENT_DATA_EXTENSION, "wb") as segment_file, \
+                open(temporary_index_path, "wb") as index_file:
+            offset = 0
+            for payment_id, record in records:
+                compressed_record = zlib.compress(json.dumps(record).encode("utf-8"))
+                segment_file.write(compressed_record)
+                # Records come by increasing id, so the index is written already sorted
+                index_file.write(INDEX_ENTRY.pack(payment_id, offset, len(compressed_record)))
+                offset += len(compressed_record)
+                records_count += 1
+            segment_file.flush()
+            os.fsync(segment_file.fileno())
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+        if records_count == 0:
+            os.remove(segment_path + SEGMENT_DATA_EXTENSION)
+            os.remove(temporary_index_path)
+            return None
+
+        # The index is renamed last: a segment is only visible once its index exists
+        os.replace(temporary_index_path, segment_path + SEGMENT_INDEX_EXTENSION)
+        self.sync_directory()
+
+        return segment_path
+
+    def load_segments(self) -> tuple:
+        """ Return the cached (first payment ids, highest last payment ids, segments),
+            reading the id range of the new segments when the directory has changed
+        """
+        try:
+            directory_mtime = os.stat(self.archive_directory).st_mtime_ns
+        except FileNotFoundError:
+            return [], [], []
+
+        with segment_cache_lock:
+            cached_mtime, *cached_segments = segment_cache.get(self.archive_directory, (None, [], [], []))
+            # A modification time too recent may not change when the next segment is added
+            if cached_mtime == directory_mtime and time.time_ns() - directory_mtime > RECENT_MTIME_NS:
+                return tuple(cached_segments)
+
+            segments = list(cached_segments[2])
+            known_paths = {segment_path for _, _, segment_path in segments}
+            for segment_path in self.list_segments():
+                if segment_path in known_paths:
+                    continue
+                with open(segment_path + SEGMENT_INDEX_EXTENSION, "rb") as index_file:
+                    first_payment_id = INDEX_ENTRY.unpack(index_file.read(INDEX_ENTRY.size))[0]
+                    index_file.seek(-INDEX_ENTRY.size, os.SEEK_END)
+                    last_payment_id = INDEX_ENTRY.unpack(index_file.read(INDEX_ENTRY.size))[0]
+                segments.append((first_payment_id, last_payment_id, segment_path))
+            segments.sort()
+            first_payment_ids = [first_payment_id for first_payment_id, _, _ in segments]
+            highest_last_ids = list(itertools.accumulate(
+                (last_payment_id for _, last_payment_id, _ in segments), max
+            ))
+            segment_cache[self.archive_directory] = (
+                directory_mtime, first_payment_ids, highest_last_ids, segments
+            )
+            return first_payment_ids, highest_last_ids, segments
+
+    def get_payment(self, payment_identifier: int) -> dict:
+        """ Return the archived record of a payment, or None if it is not archived.
+            Segments are found by bisection on their id range, the record is then
+            read with one seek.
+        """
+        first_payment_ids, highest_last_ids, segments = self.load_segments()
+        position = bisect.bisect_right(first_payment_ids, payment_identifier) - 1
+        # Segments ranges rarely overlap: going backwards, stop at the first segment
+        # after which no segment reaches the payment id
+        while position >= 0 and highest_last_ids[position] >= payment_identifier:
+            _, last_payment_id, segment_path = segments[position]
+            position -= 1
+            if last_payment_id < payment_identifier:
+                continue
+            location = self.find_in_segment(segment_path, payment_identifier)
+            if location is None:
+                continue
+            offset, length = location
+            with open(segment_path + SEGMENT_DATA_EXTENSION, "rb") as segment_file:
+                segment_file.seek(offset)
+                return json.loads(zlib.decompress(segment_file.read(length)))
+        return None
+
+    def find_in_segment(self, segment_path: str, payment_identifier: int):
+        """ Search a payment id in the index of a segment, memory-mapped on first use.
+            Only the archive_cached_segments last used indexes are kept mapped.
+            Return (offset, length) in the segment, or None if not found.
+        """
+        index_path = segment_path + SEGMENT_INDEX_EXTENSION
+        with segment_cache_lock:
+            index_map = index_map_cache.pop(index_path, None)
+            if index_map is None:
+                with open(index_path, "rb") as index_file:
+                    index_map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            index_map_cache[index_path] = index_map
+            while len(index_map_cache) > self.archive_cached_segments:
+                _, evicted_index_map = index_map_cache.popitem(last=False)
+                evicted_index_map.close()
+            # Searched with the lock held, so that the map is not closed meanwhile
+            return self.find_in_index(index_map, payment_identifier)
+
+    @staticmethod
+    def find_in_index(index_map: mmap.mmap, payment_identifier: int):
+        """ Binary search of a payment id in a memory-mapped index.
+            Return (offset, length) in the segment, or None if not found.
+        """
+        low, high = 0, len(index_map) // INDEX_ENTRY.size
+        while low < high:
+            middle = (low + high) // 2
+            payment_id, offset, length = INDEX_ENTRY.unpack_from(index_map, middle * INDEX_ENTRY.size)
+            if payment_id == payment_identifier:
+                return offset, length
+            if payment_id < payment_identifier:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+
+# Reader shared by all requests handled by the process, archive runs build their own instance
+shared_archive_payment = None
+shared_archive_payment_lock = threading.Lock()
+
+
+def get_archive_payment() -> ArchivePayment:
+    """ Return the archive reader shared by all requests, created on first use.
+        It has no database session: it is only used to read archived payments.
+    """
+    global shared_archive_payment
+    if shared_archive_payment is None:
+        with shared_archive_payment_lock:
+            if shared_archive_payment is None:
+                shared_archive_payment = ArchivePayment(db_session=None)
+    return shared_archive_payment
+
+
+if __name__ == '__main__':
+    from payment_gateway.database import SessionLocal, migrate_database
+
+    logging.basicConfig(level=logging.INFO)
+    migrate_database()
+    db_session = SessionLocal()
+    try:
+        archived_count = ArchivePayment(db_session).archive_payments()
+        logging.getLogger(__name__).info(f"{archived_count} payments archived")
+    finally:
+        db_session.close()
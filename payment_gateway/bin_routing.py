@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# ==============================================================
+#                         IMPORTS
+# ==============================================================
+import os
+import csv
+import bisect
+import logging
+import threading
+from collections import namedtuple
+from payment_gateway.config import load_config
+from payment_gateway.api_acquiring_bank import DEFAULT_ACQUIRER
+
+# ==============================================================
+#                          BASE
+# ==============================================================
+
+# Ranges are compared on the first 8 digits of the card number
+BIN_LENGTH = 8
+
+BinRoute = namedtuple("BinRoute", ["brand", "country", "acquirer"])
+
+
+class BinTable:
+    """ Class to find the brand, issuing country and acquirer of a card from its BIN.
+        Ranges are loaded from a CSV file (bin_start, bin_end, brand, country, acquirer)
+        into sorted arrays searched by bisection. A background thread checks the file
+        every refresh_seconds and swaps in a new table when it changes, so that
+        lookups never read the file. Acquirers must be in the acquirers given.
+    """
+    def __init__(self, bin_table_file: str, refresh_seconds: float, acquirers: set):
+        self.bin_table_file = bin_table_file
+        self.refresh_seconds = refresh_seconds
+        self.acquirers = acquirers
+        self.logger = logging.getLogger(__name__)
+        self.refresh_lock = threading.Lock()
+        # (range starts, range ends, routes) replaced as a whole on reload
+        self.table = ([], [], [])
+        self.file_mtime = None
+        self.refresher_thread = None
+        self.refresher_stop = threading.Event()
+        self.refresh()
+
+    @classmethod
+    def from_config(cls):
+        """ Build the BIN table with the parameters of the config.yml file
+        """
+        config = load_config()
+        return cls(
+            bin_table_file=config.get("bin_table_file"),
+            refresh_seconds=config.get("bin_table_refresh_seconds"),
+            acquirers={DEFAULT_ACQUIRER, *(config.get("acquiring_banks") or {})},
+        )
+
+    @staticmethod
+    def load_table(bin_table_file: str, acquirers: set) -> tuple:
+        """ Read the CSV file and return the sorted (range starts, range ends, routes).
+            BINs shorter than 8 digits cover every 8 digits BIN they prefix.
+            A range may be nested in a wider one: the most specific range wins.
+            Ranges which partially overlap, are defined twice, or whose acquirer
+            is not one of acquirers, are rejected.
+        """
+        rows = []
+        with open(bin_table_file, newline="") as file:
+            for row in csv.DictReader(file):
+                if None in row.values():
+                    raise ValueError(f"Incomplete BIN table row {row}")
+                if row["acquirer"] not in acquirers:
+                    raise ValueError(f"Unknown acquirer '{row['acquirer']}' for BIN range {row['bin_start']}")
+                bin_start = int(row["bin_start"].ljust(BIN_LENGTH, "0"))
+                bin_end = int(row["bin_end"].ljust(BIN_LENGTH, "9"))
+                if bin_end < bin_start:
+                    raise ValueError(f"Invalid BIN range {row['bin_start']}-{row['bin_end']}")
+                rows.append((bin_start, bin_end, BinRoute(row["brand"], row["country"], row["acquirer"])))
+        # Wider ranges first when they start at the same BIN
+        rows.sort(key=lambda row: (row[0], -row[1]))
+
+        # Split the wider ranges around the ranges nested in them
+        range_starts, range_ends, routes = [], [], []
+
+        def add_range(bin_start, bin_end, route):
+            if bin_start <= bin_end:
+                range_starts.append(bin_start)
+                range_ends.append(bin_end)
+                routes.append(route)
+
+        open_ranges = []
+        next_bin = 0
+        for bin_start, bin_end, route in rows:
+            while open_ranges and open_ranges[-1][1] < bin_start:
+                _, open_end, open_route = open_ranges.pop()
+                add_range(next_bin, open_end, open_route)
+                next_bin = open_end + 1
+            if open_ranges:
+                open_start, open_end, open_route = open_ranges[-1]
+                if bin_end > open_end:
+                    raise ValueError(f"Overlapping BIN ranges at {bin_start}")
+                if (bin_start, bin_end) == (open_start, open_end):
+                    raise ValueError(f"BIN range defined twice at {bin_start}")
+                add_range(next_bin, bin_start - 1, open_route)
+            next_bin = bin_start
+            open_ranges.append((bin_start, bin_end, route))
+        while open_ranges:
+            _, open_end, open_route = open_ranges.pop()
+            add_range(next_bin, open_end, open_route)
+            next_bin = open_end + 1
+
+        return range_starts, range_ends, routes
+
+    def refresh(self):
+        """ Reload the file if it has been modified since the last load.
+            On error the previous table is kept.
+        """
+        with self.refresh_lock:
+            try:
+                file_mtime = os.stat(self.bin_table_file).st_mtime_ns
+                if file_mtime != self.file_mtime:
+                    self.table = self.load_table(self.bin_table_file, self.acquirers)
+                    self.file_mtime = file_mtime
+                    self.logger.info(f"{len(self.table[0])} BIN ranges loaded")
+            except (OSError, ValueError, KeyError, csv.Error) as e:
+                self.logger.error(f"Error while loading BIN table: {e}")
+
+    def start_refresher(self):
+        """ Start the background thread reloading the file when it changes
+        """
+        def run_refresher():
+            while not self.refresher_stop.wait(self.refresh_seconds):
+                self.refresh()
+
+        self.refresher_stop.clear()
+        self.refresher_thread = threading.Thread(target=run_refresher, name="bin-table-refresher", daemon=True)
+        self.refresher_thread.start()
+
+    def stop_refresher(self):
+        if self.refresher_thread is not None:
+            self.refresher_stop.set()
+            self.refresher_thread.join()
+            self.refresher_thread = None
+
+    def lookup(self, card_number: str) -> BinRoute:
+        """ Return the route of the card number, or None if no range matches
+        """
+        range_starts, range_ends, routes = self.table
+        bin_number = int(card_number[:BIN_LENGTH])
+        position = bisect.bisect_right(range_starts, bin_number) - 1
+        if position >= 0 and bin_number <= range_ends[position]:
+            return routes[position]
+        return None
+
+
+# Table is shared by all requests handled by the process
+shared_bin_table = None
+shared_bin_table_lock = threading.Lock()
+
+
+def get_bin_table() -> BinTable:
+    """ Return the BIN table shared by all requests, loaded on first use
+    """
+    global shared_bin_table
+    if shared_bin_table is None:
+        with shared_bin_table_lock:
+            if shared_bin_table is None:
+                shared_bin_table = BinTable.from_config()
+                shared_bin_table.start_refresher()
+    return shared_bin_table
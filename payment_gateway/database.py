@@ -4,7 +4,9 @@
 # ==============================================================
 #                         IMPORTS
 # ==============================================================
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Sequence, UniqueConstraint
+import datetime
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Sequence, UniqueConstraint
+from sqlalchemy import inspect, text
 from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -39,6 +41,8 @@ class CardInformation(Base):
     card_number = Column(String, nullable=False)
     expiration_date = Column(String, nullable=False)
     ccv = Column(String, nullable=False)
+    # brand found in the BIN table, None if the BIN is unknown
+    brand = Column(String, nullable=True)
 
     # unicity Constraint on the 3 columns
     __table_args__ = (UniqueConstraint('card_number', 'ccv', 'expiration_date', name='_unique_credit_card'),)
@@ -57,5 +61,69 @@ class PaymentStatus(Base):
     currency = Column(String, nullable=False)
     status = Column(String, nullable=False)
     message = Column(String, nullable=False)
+    # creation date is used to move old payments to the archive
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow, index=True)
+
+    # ids of archived payments must never be given again to new payments
+    __table_args__ = {'sqlite_autoincrement': True}
 
     card = relationship("CardInformation", back_populates="payment")
+
+
+def migrate_database(db_engine=engine):
+    """ Update a database created by a previous version of the service to the current schema.
+        Called at startup: each step checks the schema and is skipped when already applied.
+        All steps run in one transaction.
+    """
+    with db_engine.connect() as connection:
+        # DDL statements are not part of pysqlite transactions, the transaction is handled here
+        connection.execution_options(isolation_level="AUTOCOMMIT")
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            table_names = inspect(connection).get_table_names()
+            if "payment_status" in table_names:
+                migrate_payment_status(connection)
+            if "card_information" in table_names:
+                migrate_card_information(connection)
+            connection.exec_driver_sql("COMMIT")
+        except Exception:
+            connection.exec_driver_sql("ROLLBACK")
+            raise
+
+
+def migrate_payment_status(connection):
+    """ Rebuild payment_status with AUTOINCREMENT and the created_at column.
+        SQLite can not add AUTOINCREMENT to an existing table, so rows are copied to a new one.
+        Payments created before the migration get the migration date as creation date.
+    """
+    table_sql = connection.exec_driver_sql(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'payment_status'"
+    ).scalar()
+    if "AUTOINCREMENT" in table_sql:
+        return
+
+    inspector = inspect(connection)
+    column_names = {column["name"] for column in inspector.get_columns("payment_status")}
+    # Index names are global in SQLite, they are created again with the new table
+    for index in inspector.get_indexes("payment_status"):
+        connection.exec_driver_sql(f"DROP INDEX {index['name']}")
+    connection.exec_driver_sql("ALTER TABLE payment_status RENAME TO payment_status_old")
+    PaymentStatus.__table__.create(connection)
+    if "created_at" in column_names:
+        created_at, parameters = "created_at", {}
+    else:
+        created_at, parameters = ":migration_date", {"migration_date": datetime.datetime.utcnow().isoformat(" ")}
+    connection.execute(text(
+        "INSERT INTO payment_status (id, card_id, amount, currency, status, message, created_at) "
+        f"SELECT id, card_id, amount, currency, status, message, {created_at} FROM payment_status_old"
+    ), parameters)
+    connection.exec_driver_sql("DROP TABLE payment_status_old")
+
+
+def migrate_card_information(connection):
+    """ Add the brand column, left empty for the cards created before the BIN table.
+        It is filled the next time the card is used.
+    """
+    column_names = {column["name"] for column in inspect(connection).get_columns("card_information")}
+    if "brand" not in column_names:
+        connection.exec_driver_sql("ALTER TABLE card_information ADD COLUMN brand VARCHAR")
@@ -0,0 +1,498 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# ==============================================================
+#                         IMPORTS
+# ==============================================================
+import os
+import time
+import zlib
+import fcntl
+import struct
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from sqlalchemy import text
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm.exc import NoResultFound
+from payment_gateway.config import load_config
+from payment_gateway.database import CardInformation, PaymentStatus, SessionLocal
+
+# ==============================================================
+#                          BASE
+# ==============================================================
+
+# Each record is a header (body length, crc32 of version and body, format version)
+# followed by the body. A zero length marks the end of the records of a preallocated segment.
+RECORD_HEADER = struct.Struct("<IIB")
+RECORD_VERSION = 1
+# Body starts with (payment id, amount, creation timestamp), followed by length prefixed strings
+RECORD_FIXED = struct.Struct("<Qdd")
+STRING_LENGTH = struct.Struct("<H")
+# Strings of the body for each format version, a new version is needed to change them
+RECORD_STRINGS = {
+    1: ("owner_name", "card_number", "expiration_date", "ccv", "brand", "currency", "status", "message"),
+}
+
+# Position of the last applied record and highest payment id ever applied:
+# (segment number, offset, payment id). Ids are never given twice, even once
+# their payments are archived and their segments removed.
+CHECKPOINT = struct.Struct("<QQQ")
+CHECKPOINT_FILE = "checkpoint"
+
+# Records which can not be loaded into the database, kept for a manual fix
+DEAD_LETTER_FILE = "dead_letter.log"
+
+# Locked by the process using the journal directory
+LOCK_FILE = "lock"
+
+SEGMENT_PREFIX = "journal_"
+SEGMENT_EXTENSION = ".log"
+
+
+def encode_record(record: dict) -> bytes:
+    """ Encode a journal record, header included
+    """
+    body = [RECORD_FIXED.pack(record["payment_id"], record["amount"], record["created_at"])]
+    for field in RECORD_STRINGS[RECORD_VERSION]:
+        value = record[field].encode("utf-8")
+        body.append(STRING_LENGTH.pack(len(value)))
+        body.append(value)
+    body = b"".join(body)
+    return RECORD_HEADER.pack(len(body), record_checksum(RECORD_VERSION, body), RECORD_VERSION) + body
+
+
+def record_checksum(version: int, body: bytes) -> int:
+    return zlib.crc32(body, zlib.crc32(bytes([version])))
+
+
+def decode_record(version: int, body: bytes) -> dict:
+    """ Decode the body of a journal record written with the given format version
+    """
+    if version not in RECORD_STRINGS:
+        raise ValueError(f"Unsupported journal record version {version}")
+    payment_id, amount, created_at = RECORD_FIXED.unpack_from(body, 0)
+    record = {"payment_id": payment_id, "amount": amount, "created_at": created_at}
+    offset = RECORD_FIXED.size
+    for field in RECORD_STRINGS[version]:
+        (length,) = STRING_LENGTH.unpack_from(body, offset)
+        offset += STRING_LENGTH.size
+        record[field] = body[offset:offset + length].decode("utf-8")
+        offset += length
+    return record
+
+
+class PaymentJournal:
+    """ Class to make payments durable with sequential appends instead of database writes.
+        Authorizations are appended to preallocated segment files and synced by batch:
+        the first waiting request syncs every record written so far, the others wait for it.
+        Records are then loaded into payment_status by apply_pending, run by a background
+        thread, and replayed from the last checkpoint after a crash.
+    """
+    def __init__(self, journal_directory: str, segment_size: int, session_factory=SessionLocal):
+        self.journal_directory = journal_directory
+        self.segment_size = segment_size
+        self.session_factory = session_factory
+        self.logger = logging.getLogger(__name__)
+
+        # Protect write position, durable position and pending records
+        self.condition = threading.Condition()
+        self.syncing = False
+        # Set when a sync fails: the journal then refuses every append
+        self.failed = False
+        # payment id -> (record, end position), in journal order
+        self.pending = OrderedDict()
+        self.applier_thread = None
+        self.applier_stop = threading.Event()
+        self.apply_lock = threading.Lock()
+
+        os.makedirs(self.journal_directory, exist_ok=True)
+        self.lock_directory()
+        try:
+            self.recover()
+        except Exception:
+            os.close(self.lock_fd)
+            raise
+
+    def lock_directory(self):
+        """ Prevent another process from writing to the same journal directory
+        """
+        self.lock_fd = os.open(os.path.join(self.journal_directory, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(self.lock_fd)
+            raise RuntimeError(f"Journal directory {self.journal_directory} is used by another process")
+
+    @classmethod
+    def from_config(cls):
+        """ Build the journal with the parameters of the config.yml file
+        """
+        config = load_config()
+        return cls(
+            journal_directory=config.get("journal_directory"),
+            segment_size=config.get("journal_segment_size"),
+        )
+
+    def segment_path(self, segment_number: int) -> str:
+        return os.path.join(self.journal_directory, f"{SEGMENT_PREFIX}{segment_number:08d}{SEGMENT_EXTENSION}")
+
+    def list_segments(self) -> list:
+        """ Return the number of every segment, sorted
+        """
+        return sorted(
+            int(file_name[len(SEGMENT_PREFIX):-len(SEGMENT_EXTENSION)])
+            for file_name in os.listdir(self.journal_directory)
+            if file_name.startswith(SEGMENT_PREFIX) and file_name.endswith(SEGMENT_EXTENSION)
+        )
+
+    def open_segment(self, segment_number: int) -> int:
+        """ Open a segment, preallocating it if it does not exist yet
+        """
+        path = self.segment_path(segment_number)
+        exists = os.path.exists(path)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if not exists:
+            if hasattr(os, "posix_fallocate"):
+                os.posix_fallocate(fd, 0, self.segment_size)
+            else:
+                os.ftruncate(fd, self.segment_size)
+            os.fsync(fd)
+            self.sync_directory()
+        return fd
+
+    def sync_directory(self):
+        """ Make durable the files created or replaced in the journal directory
+        """
+        directory_fd = os.open(self.journal_directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def read_records(self, fd: int, offset: int) -> list:
+        """ Read the records of a segment from offset.
+            Reading stops at the end of the records or at a torn write.
+            Return the list of (record, end offset).
+        """
+        segment_size = os.fstat(fd).st_size
+        records = []
+        while offset + RECORD_HEADER.size <= segment_size:
+            length, checksum, version = RECORD_HEADER.unpack(os.pread(fd, RECORD_HEADER.size, offset))
+            if length == 0 or offset + RECORD_HEADER.size + length > segment_size:
+                break
+            body = os.pread(fd, length, offset + RECORD_HEADER.size)
+            if record_checksum(version, body) != checksum:
+                break
+            offset += RECORD_HEADER.size + length
+            records.append((decode_record(version, body), offset))
+        return records
+
+    def read_checkpoint(self) -> tuple:
+        path = os.path.join(self.journal_directory, CHECKPOINT_FILE)
+        if not os.path.exists(path):
+            return (0, 0, 0)
+        with open(path, "rb") as checkpoint_file:
+            return CHECKPOINT.unpack(checkpoint_file.read(CHECKPOINT.size))
+
+    def write_checkpoint(self, position: tuple, highest_payment_id: int):
+        path = os.path.join(self.journal_directory, CHECKPOINT_FILE)
+        with open(path + ".tmp", "wb") as checkpoint_file:
+            checkpoint_file.write(CHECKPOINT.pack(*position, highest_payment_id))
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(path + ".tmp", path)
+        self.sync_directory()
+
+    def recover(self):
+        """ Load the records written after the checkpoint as pending
+            and place the write position after the last valid record
+        """
+        *checkpoint, self.highest_payment_id = self.read_checkpoint()
+        segment_numbers = [number for number in self.list_segments() if number >= checkpoint[0]]
+        if not segment_numbers:
+            segment_numbers = [max(checkpoint[0], 1)]
+
+        for segment_number in segment_numbers:
+            fd = self.open_segment(segment_number)
+            start_offset = checkpoint[1] if segment_number == checkpoint[0] else 0
+            records = self.read_records(fd, start_offset)
+            for record, end_offset in records:
+                self.pending[record["payment_id"]] = (record, (segment_number, end_offset))
+            if segment_number != segment_numbers[-1]:
+                os.close(fd)
+
+        self.fd = fd
+        self.segment_number = segment_numbers[-1]
+        self.write_offset = records[-1][1] if records else start_offset
+        self.durable_position = (self.segment_number, self.write_offset)
+        self.remove_applied_segments(checkpoint[0])
+
+        self.next_id = max([self.highest_payment_id, self.read_highest_database_id(), *self.pending]) + 1
+
+        if self.pending:
+            self.logger.info(f"{len(self.pending)} journal records to replay")
+
+    def read_highest_database_id(self) -> int:
+        """ Return the highest id ever given by the database. The AUTOINCREMENT counter of
+            payment_status is used, as payments moved to the archive are no longer in the table.
+        """
+        session = self.session_factory()
+        try:
+            return session.execute(
+                text("SELECT seq FROM sqlite_sequence WHERE name = :table_name"),
+                {"table_name": PaymentStatus.__tablename__}
+            ).scalar() or 0
+        finally:
+            session.close()
+
+    def remove_applied_segments(self, checkpoint_segment_number: int):
+        for segment_number in self.list_segments():
+            if segment_number < checkpoint_segment_number:
+                os.remove(self.segment_path(segment_number))
+
+    def append(self, record: dict) -> int:
+        """ Append a payment to the journal and wait until it is durable.
+            Return the payment id allocated to it.
+        """
+        record = dict(record, created_at=time.time())
+        with self.condition:
+            self.check_not_failed()
+            record["payment_id"] = self.next_id
+            self.next_id += 1
+            data = encode_record(record)
+            while self.write_offset > 0 and self.write_offset + len(data) > self.segment_size:
+                if self.syncing:
+                    self.condition.wait()
+                    self.check_not_failed()
+                else:
+                    self.rotate_segment()
+            os.pwrite(self.fd, data, self.write_offset)
+            self.write_offset += len(data)
+            end_position = (self.segment_number, self.write_offset)
+            self.pending[record["payment_id"]] = (record, end_position)
+
+        self.wait_durable(end_position)
+        return record["payment_id"]
+
+    def rotate_segment(self):
+        """ Sync and close the current segment and start the next one.
+            Must be called with the condition held, while no sync is running.
+        """
+        try:
+            os.fsync(self.fd)
+        except OSError:
+            self.failed = True
+            raise
+        os.close(self.fd)
+        self.durable_position = (self.segment_number, self.write_offset)
+        self.segment_number += 1
+        self.fd = self.open_segment(self.segment_number)
+        self.write_offset = 0
+
+    def check_not_failed(self):
+        if self.failed:
+            raise RuntimeError("Journal sync failed, payments can no longer be journaled")
+
+    def wait_durable(self, end_position: tuple):
+        """ Group commit: one sync makes durable every record written before it.
+            A failed sync is not retried: the kernel may have dropped the pages it could
+            not write, so a later sync succeeding would not prove they are on disk.
+        """
+        with self.condition:
+            while self.durable_position < end_position:
+                self.check_not_failed()
+                if self.syncing:
+                    self.condition.wait()
+                    continue
+                self.syncing = True
+                fd = self.fd
+                target_position = (self.segment_number, self.write_offset)
+                synced = False
+                self.condition.release()
+                try:
+                    if hasattr(os, "fdatasync"):
+                        os.fdatasync(fd)
+                    else:
+                        os.fsync(fd)
+                    synced = True
+                finally:
+                    self.condition.acquire()
+                    if synced:
+                        self.durable_position = max(self.durable_position, target_position)
+                    else:
+                        self.failed = True
+                        self.logger.error("Journal sync failed, payments are no longer accepted")
+                    self.syncing = False
+                    self.condition.notify_all()
+
+    def get_pending(self, payment_identifier: int) -> dict:
+        """ Return a payment not loaded in database yet, or None
+        """
+        with self.condition:
+            pending = self.pending.get(payment_identifier)
+        return dict(pending[0]) if pending else None
+
+    def apply_pending(self) -> int:
+        """ Load the durable pending records into the database and move the checkpoint.
+            Records already in database, from a run interrupted before its checkpoint, are skipped.
+            Records rejected by the database, or whose id is used by another payment,
+            are moved to the dead letter file.
+            Return the number of records taken from the journal.
+        """
+        with self.apply_lock:
+            return self.apply_durable_records()
+
+    def apply_durable_records(self) -> int:
+        with self.condition:
+            batch = []
+            for payment_id, (record, end_position) in self.pending.items():
+                if end_position > self.durable_position:
+                    break
+                batch.append(record)
+            if not batch:
+                return 0
+            checkpoint = self.pending[batch[-1]["payment_id"]][1]
+
+        session = self.session_factory()
+        try:
+            try:
+                conflicts = [record for record in batch if not self.apply_record(session, record)]
+                session.commit()
+            except (IntegrityError, DataError) as e:
+                # Find the failing records by applying them one by one
+                session.rollback()
+                self.logger.warning(f"Error while applying journal batch, retrying record by record: {e}")
+                conflicts = []
+                for record in batch:
+                    try:
+                        if not self.apply_record(session, record):
+                            conflicts.append(record)
+                        session.commit()
+                    except (IntegrityError, DataError) as e:
+                        session.rollback()
+                        self.write_dead_letter(record, str(e))
+            for record in conflicts:
+                self.write_dead_letter(record, "payment id already used by another payment")
+        except Exception as e:
+            session.rollback()
+            self.logger.error(f"Error while applying journal: {e}")
+            raise
+        finally:
+            session.close()
+
+        self.highest_payment_id = max(self.highest_payment_id, *(record["payment_id"] for record in batch))
+        self.write_checkpoint(checkpoint, self.highest_payment_id)
+        with self.condition:
+            for record in batch:
+                del self.pending[record["payment_id"]]
+        self.remove_applied_segments(checkpoint[0])
+        return len(batch)
+
+    def apply_record(self, session, record: dict) -> bool:
+        """ Add a journal record to the session, unless it is already in database.
+            Return False if its id is used by a different payment.
+        """
+        created_at = datetime.datetime.fromtimestamp(record["created_at"], datetime.timezone.utc).replace(tzinfo=None)
+        payment_status = session.get(PaymentStatus, record["payment_id"])
+        if payment_status is not None:
+            # Replay of a record committed before its checkpoint was written
+            return (
+                payment_status.created_at == created_at
+                and payment_status.amount == record["amount"]
+                and payment_status.currency == record["currency"]
+                and payment_status.status == record["status"]
+                and payment_status.message == record["message"]
+                and payment_status.card.card_number == record["card_number"]
+            )
+        session.add(PaymentStatus(
+            id=record["payment_id"],
+            card_id=self.get_or_create_card_id(session, record),
+            amount=record["amount"],
+            currency=record["currency"],
+            status=record["status"],
+            message=record["message"],
+            created_at=created_at
+        ))
+        session.flush()
+        return True
+
+    def write_dead_letter(self, record: dict, reason: str):
+        """ Keep a record rejected by the database in the dead letter file
+        """
+        with open(os.path.join(self.journal_directory, DEAD_LETTER_FILE), "ab") as dead_letter_file:
+            dead_letter_file.write(encode_record(record))
+            dead_letter_file.flush()
+            os.fsync(dead_letter_file.fileno())
+        self.sync_directory()
+        self.logger.error(f"Payment {record['payment_id']} moved to {DEAD_LETTER_FILE}: {reason}")
+
+    @staticmethod
+    def get_or_create_card_id(session, record: dict) -> int:
+        """ Return the id of the card, looked up on the columns of its unicity constraint
+        """
+        try:
+            return session.query(CardInformation).filter_by(
+                card_number=record["card_number"],
+                expiration_date=record["expiration_date"],
+                ccv=record["ccv"]
+            ).one().id
+        except NoResultFound:
+            card_information = CardInformation(
+                owner_name=record["owner_name"],
+                card_number=record["card_number"],
+                expiration_date=record["expiration_date"],
+                ccv=record["ccv"],
+                brand=record["brand"] or None
+            )
+            session.add(card_information)
+            session.flush()
+            return card_information.id
+
+    def start_applier(self, interval_seconds: float):
+        """ Start the background thread loading the journal into the database
+        """
+        def run_applier():
+            while not self.applier_stop.wait(interval_seconds):
+                try:
+                    self.apply_pending()
+                except Exception:
+                    self.logger.exception("Journal applier failed, retrying")
+
+        self.applier_stop.clear()
+        self.applier_thread = threading.Thread(target=run_applier, name="payment-journal-applier", daemon=True)
+        self.applier_thread.start()
+
+    def close(self):
+        """ Stop the applier, apply what is left, close the current segment
+            and release the journal directory
+        """
+        if self.applier_thread is not None:
+            self.applier_stop.set()
+            self.applier_thread.join()
+            self.applier_thread = None
+        self.apply_pending()
+        with self.condition:
+            os.close(self.fd)
+        os.close(self.lock_fd)
+
+
+# Journal is shared by all requests handled by the process. The journal mode is read
+# once, so that requests do not parse config.yml when the journal is disabled
+shared_payment_journal = None
+shared_payment_journal_loaded = False
+shared_payment_journal_lock = threading.Lock()
+
+
+def get_payment_journal() -> PaymentJournal:
+    """ Return the journal shared by all requests, or None if journal mode is disabled
+    """
+    global shared_payment_journal, shared_payment_journal_loaded
+    if not shared_payment_journal_loaded:
+        with shared_payment_journal_lock:
+            if not shared_payment_journal_loaded:
+                if load_config().get("journal_mode") is True:
+                    shared_payment_journal = PaymentJournal.from_config()
+                shared_payment_journal_loaded = True
+    return shared_payment_journal
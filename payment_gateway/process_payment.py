@@ -10,6 +10,9 @@ from sqlalchemy.orm import Session
 from sqlalchemy.orm.exc import NoResultFound
 from payment_gateway.transaction_format import TransactionFormat
 from payment_gateway.api_acquiring_bank import APIAcquiringBank
+from payment_gateway.velocity_check import VelocityCheck, get_velocity_check
+from payment_gateway.payment_journal import PaymentJournal, get_payment_journal
+from payment_gateway.bin_routing import BinTable, get_bin_table
 from payment_gateway.database import CardInformation, PaymentStatus
 
 # ==============================================================
@@ -20,8 +23,12 @@ from payment_gateway.database import CardInformation, PaymentStatus
 class ProcessPayment:
     """ Class to process the payment
     """
-    def __init__(self, db_session: Session):
+    def __init__(self, db_session: Session, velocity_check: VelocityCheck = None, journal: PaymentJournal = None,
+                 bin_table: BinTable = None):
         self.api_bank = APIAcquiringBank()
+        self.velocity_check = velocity_check or get_velocity_check()
+        self.journal = journal or get_payment_journal()
+        self.bin_table = bin_table or get_bin_table()
         self.db_session = db_session
         self.logger = logging.getLogger(__name__)
 
@@ -39,7 +46,7 @@ class ProcessPayment:
         finally:
             self.db_session.close()
 
-    def get_or_create_card_information(self, payment_data: TransactionFormat) -> int:
+    def get_or_create_card_information(self, payment_data: TransactionFormat, brand: str = None) -> int:
         """ Method to check if card information exists in database.
             Return the id of the corresponding line in database
         """
@@ -51,6 +58,9 @@ class ProcessPayment:
                     expiration_date=payment_data.expiration_date,
                     ccv=payment_data.ccv
                 ).one()
+                # cards stored before the BIN table was available have no brand
+                if card_information.brand is None and brand is not None:
+                    card_information.brand = brand
                 return card_information.id
             except NoResultFound:
                 # if card does not exists, we create it
@@ -58,7 +68,8 @@ class ProcessPayment:
                     owner_name=payment_data.card_owner,
                     card_number=payment_data.card_number,
                     expiration_date=payment_data.expiration_date,
-                    ccv=payment_data.ccv
+                    ccv=payment_data.ccv,
+                    brand=brand
                 )
                 session.add(card_information)
                 session.flush()
@@ -66,28 +77,59 @@ class ProcessPayment:
 
     def submit_payment(self, payment_data: TransactionFormat) -> dict:
         """ Get the payment details provided by the merchant and
+            - reject the payment if the card exceeds the velocity thresholds
+            - find the card brand and acquirer in the BIN table
             - call Acquiring Bank API
-            - store result in database
+            - store result in database, or in the journal if journal mode is enabled
             - return result
         """
+        # Reject card testing attacks without calling the bank nor the database
+        velocity_rejection_reason = self.velocity_check.check_payment(payment_data)
+        if velocity_rejection_reason is not None:
+            return {
+                "payment_id": None,
+                "status": "payment rejected",
+                "reason": velocity_rejection_reason
+            }
+
+        # Route the payment according to the card BIN, the default bank is used for unknown BINs
+        bin_route = self.bin_table.lookup(payment_data.card_number)
+        brand = bin_route.brand if bin_route is not None else None
+        acquirer = bin_route.acquirer if bin_route is not None else None
+
         # Call Acquiring Bank API and raise error if any
-        response_api_acquiring_bank = self.api_bank.call_acquiring_bank(payment_data)
+        response_api_acquiring_bank = self.api_bank.call_acquiring_bank(payment_data, acquirer)
 
-        # Store result in database
-        card_id = self.get_or_create_card_information(payment_data)
-        with self.get_session() as session:
-            payment_status = PaymentStatus(
-                card_id=card_id,
-                amount=payment_data.amount,
-                currency=payment_data.currency,
-                status=str(response_api_acquiring_bank['code']),
-                message=response_api_acquiring_bank['message']
-            )
-            session.add(payment_status)
-            session.flush()
-            payment_id = payment_status.id
-            payment_code = payment_status.status
-            payment_message = payment_status.message
+        payment_code = str(response_api_acquiring_bank['code'])
+        payment_message = response_api_acquiring_bank['message']
+
+        if self.journal is not None:
+            # Store result in journal, it will be loaded in database in background
+            payment_id = self.journal.append({
+                "owner_name": payment_data.card_owner,
+                "card_number": payment_data.card_number,
+                "expiration_date": payment_data.expiration_date,
+                "ccv": payment_data.ccv,
+                "brand": brand or "",
+                "amount": payment_data.amount,
+                "currency": payment_data.currency,
+                "status": payment_code,
+                "message": payment_message
+            })
+        else:
+            # Store result in database
+            card_id = self.get_or_create_card_information(payment_data, brand)
+            with self.get_session() as session:
+                payment_status = PaymentStatus(
+                    card_id=card_id,
+                    amount=payment_data.amount,
+                    currency=payment_data.currency,
+                    status=payment_code,
+                    message=payment_message
+                )
+                session.add(payment_status)
+                session.flush()
+                payment_id = payment_status.id
 
         # Return Payment status and information
         result_process_payment = {
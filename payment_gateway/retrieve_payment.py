@@ -6,6 +6,8 @@
 # ==============================================================
 from sqlalchemy.orm import Session
 from payment_gateway.database import PaymentStatus, CardInformation
+from payment_gateway.archive_payment import get_archive_payment
+from payment_gateway.payment_journal import get_payment_journal
 
 # ==============================================================
 #                          BASE
@@ -17,11 +19,33 @@ class RetrievePayment:
     """
     def __init__(self, db_session: Session):
         self.db_session = db_session
+        self.archive = get_archive_payment()
+        self.journal = get_payment_journal()
 
     def get_payment(self, payment_identifier: int) -> dict:
         """ Return Payment details according to the id provided
             by the merchant.
+            Payments not loaded in database yet are found in the journal,
+            payments which are no longer in database are looked up in the archive.
         """
+        # Journal is read first: once applied, a record leaves the journal after its database commit
+        if self.journal is not None:
+            pending_payment = self.journal.get_pending(payment_identifier)
+            if pending_payment is not None:
+                card_number = pending_payment["card_number"]
+                return {
+                    "payment_id": pending_payment["payment_id"],
+                    "status_code": pending_payment["status"],
+                    "message": pending_payment["message"],
+                    "amount": pending_payment["amount"],
+                    "currency": pending_payment["currency"],
+                    "card_owner": pending_payment["owner_name"],
+                    "card_number": '*' * (len(card_number) - 4) + card_number[-4:],
+                    "expiration_date": pending_payment["expiration_date"],
+                    "ccv": pending_payment["ccv"],
+                    "card_brand": pending_payment["brand"] or None,
+                }
+
         payment = self.db_session.query(PaymentStatus).filter_by(id=payment_identifier).first()
 
         if payment:
@@ -39,6 +63,14 @@ class RetrievePayment:
                 "card_number": masked_card_number,
                 "expiration_date": card_information.expiration_date,
                 "ccv": card_information.ccv,
+                "card_brand": card_information.brand,
             }
-        else:
+
+        archived_payment = self.archive.get_payment(payment_identifier)
+        if archived_payment is None:
             return None
+
+        card_number = archived_payment["card_number"]
+        archived_payment["card_number"] = '*' * (len(card_number) - 4) + card_number[-4:]
+        del archived_payment["created_at"]
+        return archived_payment
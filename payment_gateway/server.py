@@ -6,7 +6,9 @@
 # ==============================================================
 from fastapi import FastAPI, HTTPException, status, Query, Body, Depends
 from sqlalchemy.orm import Session
-from payment_gateway.database import get_db
+from payment_gateway.config import load_config
+from payment_gateway.database import get_db, migrate_database
+from payment_gateway.payment_journal import get_payment_journal
 from payment_gateway.process_payment import ProcessPayment
 from payment_gateway.retrieve_payment import RetrievePayment
 from payment_gateway.transaction_format import TransactionFormat
@@ -18,8 +20,36 @@ from payment_gateway.transaction_format import TransactionFormat
 payment_gateway_app = FastAPI()
 
 
+@payment_gateway_app.on_event("startup")
+def update_database_schema():
+    """ Bring a database created by a previous version to the current schema
+    """
+    migrate_database()
+
+
+@payment_gateway_app.on_event("startup")
+def start_payment_journal():
+    """ In journal mode, replay the journal left by the previous run
+        and start loading new payments into the database in background
+    """
+    payment_journal = get_payment_journal()
+    if payment_journal is not None:
+        payment_journal.apply_pending()
+        payment_journal.start_applier(load_config().get("journal_apply_interval_seconds"))
+
+
+@payment_gateway_app.on_event("shutdown")
+def stop_payment_journal():
+    payment_journal = get_payment_journal()
+    if payment_journal is not None:
+        payment_journal.close()
+
+
+# Routes are not async: FastAPI runs them in its thread pool, so that database
+# calls and journal syncs do not block the event loop and concurrent payments
+# can share the same journal sync
 @payment_gateway_app.post('/process_payment', status_code=status.HTTP_200_OK)
-async def process_payment_route(payment_data: TransactionFormat = Body(...), db: Session = Depends(get_db)):
+def process_payment_route(payment_data: TransactionFormat = Body(...), db: Session = Depends(get_db)):
     try:
         process_payment_instance = ProcessPayment(db)
         result_process_payment = process_payment_instance.submit_payment(payment_data)
@@ -31,7 +61,7 @@ async def process_payment_route(payment_data: TransactionFormat = Body(...), db:
 
 
 @payment_gateway_app.get('/retrieve_payment', status_code=status.HTTP_200_OK)
-async def retrieve_payment_route(payment_identifier: int = Query(...), db: Session = Depends(get_db)):
+def retrieve_payment_route(payment_identifier: int = Query(...), db: Session = Depends(get_db)):
     retrieve_payment_instance = RetrievePayment(db)
     payment_details = retrieve_payment_instance.get_payment(payment_identifier)
 
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# ==============================================================
+#                         IMPORTS
+# ==============================================================
+import time
+import threading
+from collections import OrderedDict, deque
+from payment_gateway.config import load_config
+from payment_gateway.transaction_format import TransactionFormat
+
+# ==============================================================
+#                          BASE
+# ==============================================================
+
+# Key of max_amounts used for the currencies without their own limit
+DEFAULT_CURRENCY = "DEFAULT"
+
+
+class VelocityCheck:
+    """ Class to reject card testing attacks before the Acquiring Bank is called.
+        Attempts and amounts are counted per card in memory, over a sliding window
+        made of fixed size time buckets. Amounts are counted and limited per currency,
+        with the 'default' limit of max_amounts for currencies without their own.
+        Cards idle for longer than the window, or the least recently used ones
+        above max_cards, are evicted.
+    """
+    def __init__(self, window_seconds: int, bucket_seconds: int, max_attempts: int,
+                 max_amounts: dict, max_cards: int, clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.max_attempts = max_attempts
+        self.max_amounts = {currency.upper(): max_amount for currency, max_amount in max_amounts.items()}
+        self.max_cards = max_cards
+        self.clock = clock
+        # card number -> deque of [bucket start, attempts, {currency: amount}], least recently used first
+        self.cards = OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls):
+        """ Build the velocity check with the thresholds of the config.yml file
+        """
+        config = load_config()
+        return cls(
+            window_seconds=config.get("velocity_window_seconds"),
+            bucket_seconds=config.get("velocity_bucket_seconds"),
+            max_attempts=config.get("velocity_max_attempts"),
+            max_amounts=config.get("velocity_max_amounts"),
+            max_cards=config.get("velocity_max_cards"),
+        )
+
+    def check_payment(self, payment_data: TransactionFormat) -> str:
+        """ Record the payment attempt and check the card thresholds.
+            Amounts of rejected payments are not added to the window.
+            Return the reason of the rejection, or None if the payment can go on.
+        """
+        now = self.clock()
+        bucket_start = now - now % self.bucket_seconds
+        currency = payment_data.currency.upper()
+        max_amount = self.max_amounts.get(currency, self.max_amounts[DEFAULT_CURRENCY])
+
+        with self.lock:
+            self.evict_idle_cards(now)
+            buckets = self.cards.pop(payment_data.card_number, None)
+            if buckets is None:
+                buckets = deque()
+            self.cards[payment_data.card_number] = buckets
+            if len(self.cards) > self.max_cards:
+                self.cards.popitem(last=False)
+
+            # Drop the buckets which left the window
+            while buckets and buckets[0][0] <= now - self.window_seconds:
+                buckets.popleft()
+            if not buckets or buckets[-1][0] != bucket_start:
+                buckets.append([bucket_start, 0, {}])
+            # Every attempt is counted, the amount only when the payment passes the check
+            buckets[-1][1] += 1
+
+            if sum(bucket[1] for bucket in buckets) > self.max_attempts:
+                return "Too many payment attempts with this card"
+            if sum(bucket[2].get(currency, 0.0) for bucket in buckets) + payment_data.amount > max_amount:
+                return "Payment amount limit reached for this card"
+            buckets[-1][2][currency] = buckets[-1][2].get(currency, 0.0) + payment_data.amount
+        return None
+
+    def evict_idle_cards(self, now: float):
+        """ Remove the cards without any attempt during the window.
+            Cards are ordered by last use so only the oldest ones are checked.
+        """
+        while self.cards:
+            card_number, buckets = next(iter(self.cards.items()))
+            if buckets and buckets[-1][0] > now - self.window_seconds:
+                break
+            del self.cards[card_number]
+
+
+# Counters are shared by all requests handled by the process
+shared_velocity_check = None
+
+
+def get_velocity_check() -> VelocityCheck:
+    """ Return the velocity check shared by all requests, created on first use
+    """
+    global shared_velocity_check
+    if shared_velocity_check is None:
+        shared_velocity_check = VelocityCheck.from_config()
+    return shared_velocity_check
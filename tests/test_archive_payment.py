@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# ==============================================================
+#                         IMPORTS
+# ==============================================================
+import os
+import datetime
+import tempfile
+import unittest
+from unittest.mock import patch
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+from payment_gateway.archive_payment import ArchivePayment, index_map_cache
+from payment_gateway.config import load_config
+from payment_gateway.database import Base, CardInformation, PaymentStatus
+from payment_gateway.retrieve_payment import RetrievePayment
+
+# ==============================================================
+#                          BASE
+# ==============================================================
+
+# Test Configuration for database
+TEST_DB_URI = 'sqlite:///:memory:'
+
+
+class TestArchivePayment(unittest.TestCase):
+    def setUp(self):
+        # Create a database and an archive directory for tests
+        self.engine = create_engine(TEST_DB_URI)
+        Base.metadata.create_all(self.engine)
+        self.db_session = Session(bind=self.engine)
+        self.archive_directory = tempfile.TemporaryDirectory()
+        self.archive = ArchivePayment(self.db_session, self.archive_directory.name, 30)
+
+        card_information = CardInformation(
+            owner_name="John Doe",
+            card_number="4012888888881881",
+            expiration_date="12/25",
+            ccv="123"
+        )
+        self.db_session.add(card_information)
+        self.db_session.flush()
+        now = datetime.datetime.utcnow()
+        for payment_id, age_days in [(1, 100), (2, 60), (3, 1)]:
+            self.db_session.add(PaymentStatus(
+                id=payment_id,
+                card_id=card_information.id,
+                amount=10.0 * payment_id,
+                currency="USD",
+                status="200",
+                message="Payment executed succesfully",
+                created_at=now - datetime.timedelta(days=age_days)
+            ))
+        self.db_session.commit()
+
+    def tearDown(self):
+        # Clean database and archive after each test
+        self.db_session.close()
+        Base.metadata.drop_all(self.engine)
+        self.archive_directory.cleanup()
+
+    def test_archive_old_payments(self):
+        archived_count = self.archive.archive_payments()
+
+        self.assertEqual(archived_count, 2)
+        remaining_ids = [payment.id for payment in self.db_session.query(PaymentStatus).all()]
+        self.assertEqual(remaining_ids, [3])
+        self.assertEqual(len(self.archive.list_segments()), 1)
+
+    def test_segment_synced_before_rows_deleted(self):
+        def check_rows_not_deleted():
+            self.assertEqual(self.db_session.query(PaymentStatus).count(), 3)
+
+        with patch.object(self.archive, "sync_directory", side_effect=check_rows_not_deleted) as sync_directory:
+            self.archive.archive_payments()
+
+        sync_directory.assert_called_once_with()
+        self.assertEqual(self.db_session.query(PaymentStatus).count(), 1)
+
+    def test_archive_directory_locked(self):
+        lock_fd = self.archive.lock_directory()
+        try:
+            with self.assertRaises(RuntimeError):
+                self.archive.archive_payments()
+        finally:
+            os.close(lock_fd)
+
+        self.assertEqual(self.db_session.query(PaymentStatus).count(), 3)
+        self.assertEqual(self.archive.archive_payments(), 2)
+
+    def test_interrupted_segment_is_not_reused(self):
+        # Data file left by a run interrupted before its index was written
+        with open(os.path.join(self.archive_directory.name, "segment_00000000.dat"), "wb") as segment_file:
+            segment_file.write(b"interrupted")
+
+        self.archive.archive_payments()
+
+        self.assertEqual(self.archive.list_segments(), [os.path.join(self.archive_directory.name, "segment_00000001")])
+        self.assertEqual(self.archive.get_payment(1)["payment_id"], 1)
+
+    def test_archive_nothing_to_archive(self):
+        self.archive.archive_threshold_days = 365
+
+        self.assertEqual(self.archive.archive_payments(), 0)
+        self.assertEqual(self.archive.list_segments(), [])
+
+    def test_get_archived_payment(self):
+        self.archive.archive_payments()
+
+        archived_payment = self.archive.get_payment(2)
+        self.assertEqual(archived_payment["payment_id"], 2)
+        self.assertEqual(archived_payment["amount"], 20.0)
+        self.assertEqual(archived_payment["card_number"], "4012888888881881")
+        self.assertIsNone(self.archive.get_payment(3))
+        self.assertIsNone(self.archive.get_payment(999))
+
+    def test_get_payment_across_segments(self):
+        self.archive.archive_payments()
+        self.archive.archive_threshold_days = 0
+        self.archive.archive_payments()
+
+        self.assertEqual(len(self.archive.list_segments()), 2)
+        # Cards are kept, a new payment may use them while they are archived
+        self.assertEqual(self.db_session.query(CardInformation).count(), 1)
+        self.assertEqual(self.archive.get_payment(1)["payment_id"], 1)
+        self.assertEqual(self.archive.get_payment(3)["payment_id"], 3)
+
+    def test_archive_by_batches(self):
+        self.archive.archive_batch_size = 1
+
+        self.assertEqual(self.archive.archive_payments(), 2)
+        # Batches of a run share one segment
+        self.assertEqual(len(self.archive.list_segments()), 1)
+        self.assertEqual(self.db_session.query(PaymentStatus).count(), 1)
+        self.assertEqual(self.archive.get_payment(1)["payment_id"], 1)
+        self.assertEqual(self.archive.get_payment(2)["payment_id"], 2)
+
+    def test_only_segment_of_the_payment_is_searched(self):
+        for archive_threshold_days in [90, 30, 0]:
+            self.archive.archive_threshold_days = archive_threshold_days
+            self.archive.archive_payments()
+        self.assertEqual(len(self.archive.list_segments()), 3)
+
+        find_in_segment = self.archive.find_in_segment
+        with patch.object(self.archive, "find_in_segment", wraps=find_in_segment) as find_in_segment:
+            self.assertEqual(self.archive.get_payment(2)["payment_id"], 2)
+            self.assertEqual(find_in_segment.call_count, 1)
+            self.assertIsNone(self.archive.get_payment(999))
+            self.assertEqual(find_in_segment.call_count, 1)
+
+    def test_mapped_indexes_are_bounded(self):
+        for archive_threshold_days in [90, 30, 0]:
+            self.archive.archive_threshold_days = archive_threshold_days
+            self.archive.archive_payments()
+        self.archive.archive_cached_segments = 2
+
+        for payment_id in [1, 2, 3, 1]:
+            self.assertEqual(self.archive.get_payment(payment_id)["payment_id"], payment_id)
+
+        mapped_index_paths = [path for path in index_map_cache if path.startswith(self.archive_directory.name)]
+        self.assertEqual([os.path.basename(path) for path in mapped_index_paths],
+                         ["segment_00000002.idx", "segment_00000000.idx"])
+
+    def test_new_segment_visible_after_cached_lookup(self):
+        self.archive.archive_payments()
+        self.assertIsNone(self.archive.get_payment(3))
+
+        self.archive.archive_threshold_days = 0
+        self.archive.archive_payments()
+
+        self.assertEqual(self.archive.get_payment(3)["payment_id"], 3)
+
+    def test_archived_ids_are_not_reused(self):
+        self.archive.archive_threshold_days = 0
+        self.archive.archive_payments()
+        self.assertEqual(self.db_session.query(PaymentStatus).count(), 0)
+
+        card_information = CardInformation(
+            owner_name="Jane Doe",
+            card_number="8142740445497749",
+            expiration_date="03/25",
+            ccv="456"
+        )
+        self.db_session.add(card_information)
+        self.db_session.flush()
+        payment_status = PaymentStatus(
+            card_id=card_information.id,
+            amount=5.0,
+            currency="EUR",
+            status="200",
+            message="Payment executed succesfully"
+        )
+        self.db_session.add(payment_status)
+        self.db_session.commit()
+
+        self.assertEqual(payment_status.id, 4)
+        self.assertEqual(self.archive.get_payment(3)["card_owner"], "John Doe")
+
+    def test_retrieve_payment_falls_back_to_archive(self):
+        self.archive.archive_payments()
+        retrieve_payment = RetrievePayment(self.db_session)
+        retrieve_payment.archive = self.archive
+
+        retrieved_payment_details = retrieve_payment.get_payment(1)
+
+        self.assertEqual(retrieved_payment_details["payment_id"], 1)
+        self.assertEqual(retrieved_payment_details["card_number"], '*' * 12 + "1881")
+        self.assertNotIn("created_at", retrieved_payment_details)
+
+
+    def test_archive_reader_shared_by_requests(self):
+        with patch('payment_gateway.archive_payment.load_config', wraps=load_config) as mock_load_config:
+            first_retrieve_payment = RetrievePayment(self.db_session)
+            second_retrieve_payment = RetrievePayment(self.db_session)
+
+        self.assertIs(first_retrieve_payment.archive, second_retrieve_payment.archive)
+        self.assertLessEqual(mock_load_config.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# ==============================================================
+#                         IMPORTS
+# ==============================================================
+import os
+import time
+import tempfile
+import unittest
+from unittest.mock import Mock, MagicMock, patch
+from payment_gateway.bin_routing import BinTable
+from payment_gateway.api_acquiring_bank import APIAcquiringBank
+from payment_gateway.process_payment import ProcessPayment
+
+# ==============================================================
+#                          BASE
+# ==============================================================
+
+# The US range is nested in the generic Visa range
+BIN_TABLE_CONTENT = """bin_start,bin_end,brand,country,acquirer
+4,4,visa,,default
+401288,401288,visa,US,us_bank
+51,55,mastercard,,default
+"""
+
+OVERLAPPING_BIN_TABLE_CONTENT = """bin_start,bin_end,brand,country,acquirer
+40,45,visa,,default
+44,49,visa,US,us_bank
+"""
+
+DUPLICATED_BIN_TABLE_CONTENT = """bin_start,bin_end,brand,country,acquirer
+4,4,visa,,default
+4,4,visa,US,us_bank
+"""
+
+UNKNOWN_ACQUIRER_BIN_TABLE_CONTENT = """bin_start,bin_end,brand,country,acquirer
+4,4,visa,,unknown_bank
+"""
+
+ACQUIRERS = {"default", "us_bank", "other_bank"}
+
+
+class TestBinTable(unittest.TestCase):
+    def setUp(self):
+        self.bin_table_directory = tempfile.TemporaryDirectory()
+        self.bin_table_file = os.path.join(self.bin_table_directory.name, "bin_ranges.csv")
+        self.write_bin_table(BIN_TABLE_CONTENT)
+        self.bin_table = BinTable(self.bin_table_file, refresh_seconds=60, acquirers=ACQUIRERS)
+
+    def tearDown(self):
+        self.bin_table.stop_refresher()
+        self.bin_table_directory.cleanup()
+
+    def write_bin_table(self, content):
+        with open(self.bin_table_file, "w") as file:
+            file.write(content)
+
+    def test_lookup(self):
+        self.assertEqual(self.bin_table.lookup("4012888888881881").acquirer, "us_bank")
+        self.assertEqual(self.bin_table.lookup("4012888888881881").country, "US")
+        self.assertEqual(self.bin_table.lookup("4111111111111111").brand, "visa")
+        # Both sides of the nested range still use the generic one
+        self.assertEqual(self.bin_table.lookup("4012879999999999").acquirer, "default")
+        self.assertEqual(self.bin_table.lookup("4012890000000000").acquirer, "default")
+        self.assertEqual(self.bin_table.lookup("5500000000000004").brand, "mastercard")
+        self.assertIsNone(self.bin_table.lookup("3400000000000009"))
+        self.assertIsNone(self.bin_table.lookup("5600000000000000"))
+
+    def test_nested_ranges_are_flattened(self):
+        range_starts, range_ends, routes = BinTable.load_table(self.bin_table_file, ACQUIRERS)
+
+        self.assertEqual(range_starts, [40000000, 40128800, 40128900, 51000000])
+        self.assertEqual(range_ends, [40128799, 40128899, 49999999, 55999999])
+        self.assertEqual([route.acquirer for route in routes], ["default", "us_bank", "default", "default"])
+
+    def test_overlapping_ranges_are_rejected(self):
+        self.write_bin_table(OVERLAPPING_BIN_TABLE_CONTENT)
+
+        with self.assertRaises(ValueError):
+            BinTable.load_table(self.bin_table_file, ACQUIRERS)
+
+    def test_duplicated_ranges_are_rejected(self):
+        self.write_bin_table(DUPLICATED_BIN_TABLE_CONTENT)
+
+        with self.assertRaises(ValueError):
+            BinTable.load_table(self.bin_table_file, ACQUIRERS)
+
+    def test_unknown_acquirer_is_rejected(self):
+        self.write_bin_table(UNKNOWN_ACQUIRER_BIN_TABLE_CONTENT)
+
+        with self.assertRaises(ValueError):
+            BinTable.load_table(self.bin_table_file, ACQUIRERS)
+
+    def test_refresh_after_file_change(self):
+        self.write_bin_table("bin_start,bin_end,brand,country,acquirer\n4,4,visa,,other_bank\n")
+        os.utime(self.bin_table_file, ns=(0, 0))
+
+        # Lookups never read the file
+        self.assertEqual(self.bin_table.lookup("4012888888881881").acquirer, "us_bank")
+        self.bin_table.refresh()
+        self.assertEqual(self.bin_table.lookup("4012888888881881").acquirer, "other_bank")
+
+    def test_background_refresh(self):
+        self.bin_table.refresh_seconds = 0.01
+        self.bin_table.start_refresher()
+        self.write_bin_table("bin_start,bin_end,brand,country,acquirer\n4,4,visa,,other_bank\n")
+        os.utime(self.bin_table_file, ns=(0, 0))
+
+        for _ in range(200):
+            if self.bin_table.lookup("4012888888881881").acquirer == "other_bank":
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.bin_table.lookup("4012888888881881").acquirer, "other_bank")
+
+    def test_invalid_file_keeps_previous_table(self):
+        self.write_bin_table(OVERLAPPING_BIN_TABLE_CONTENT)
+        os.utime(self.bin_table_file, ns=(0, 0))
+        self.bin_table.refresh()
+
+        self.assertEqual(self.bin_table.lookup("4012888888881881").acquirer, "us_bank")
+
+    def test_unreadable_files_keep_previous_table(self):
+        for content in [
+            UNKNOWN_ACQUIRER_BIN_TABLE_CONTENT,
+            # Row without acquirer
+            "bin_start,bin_end,brand,country,acquirer\n4,4,visa\n",
+            # Field above the csv module limit
+            'bin_start,bin_end,brand,country,acquirer\n"' + "4" * 200000 + '",4,visa,,default\n',
+        ]:
+            self.write_bin_table(content)
+            os.utime(self.bin_table_file, ns=(0, 0))
+            self.bin_table.refresh()
+
+            self.assertEqual(self.bin_table.lookup("4012888888881881").acquirer, "us_bank")
+
+    def test_get_acquiring_bank(self):
+        api_bank = APIAcquiringBank()
+        api_bank.acquiring_banks = {"us_bank": {"api_url": "https://us.bank", "api_key": "key"}}
+
+        self.assertEqual(api_bank.get_acquiring_bank("us_bank"), ("https://us.bank", "key"))
+        self.assertEqual(api_bank.get_acquiring_bank(None), (api_bank.acquiring_bank_api_url,
+                                                             api_bank.acquiring_bank_api_key))
+        with self.assertRaises(ValueError):
+            api_bank.get_acquiring_bank("unknown_bank")
+
+    @patch('payment_gateway.api_acquiring_bank.APIAcquiringBank.call_acquiring_bank')
+    def test_submit_payment_routed_by_bin(self, mock_call_acquiring_bank):
+        mock_call_acquiring_bank.return_value = {'code': '200', 'message': 'Payment successful'}
+        payment_data = Mock(card_number="4012888888881881", amount=50.0)
+        process_payment = ProcessPayment(Mock(), bin_table=self.bin_table)
+        process_payment.get_or_create_card_information = Mock(return_value=1)
+        process_payment.get_session = MagicMock()
+        process_payment.journal = None
+
+        process_payment.submit_payment(payment_data)
+
+        mock_call_acquiring_bank.assert_called_once_with(payment_data, "us_bank")
+        process_payment.get_or_create_card_information.assert_called_once_with(payment_data, "visa")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# ==============================================================
+#                         IMPORTS
+# ==============================================================
+import os
+import tempfile
+import unittest
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import Session
+from payment_gateway.database import CardInformation, PaymentStatus, migrate_database
+
+# ==============================================================
+#                          BASE
+# ==============================================================
+
+# Schema of the database before the archive, journal and BIN table were added
+PREVIOUS_SCHEMA = [
+    """CREATE TABLE card_information (
+        id INTEGER NOT NULL,
+        owner_name VARCHAR NOT NULL,
+        card_number VARCHAR NOT NULL,
+        expiration_date VARCHAR NOT NULL,
+        ccv VARCHAR NOT NULL,
+        PRIMARY KEY (id),
+        CONSTRAINT _unique_credit_card UNIQUE (card_number, ccv, expiration_date)
+    )""",
+    "CREATE INDEX ix_card_information_id ON card_information (id)",
+    """CREATE TABLE payment_status (
+        id INTEGER NOT NULL,
+        card_id INTEGER,
+        amount FLOAT NOT NULL,
+        currency VARCHAR NOT NULL,
+        status VARCHAR NOT NULL,
+        message VARCHAR NOT NULL,
+        PRIMARY KEY (id),
+        FOREIGN KEY(card_id) REFERENCES card_information (id)
+    )""",
+    "CREATE INDEX ix_payment_status_id ON payment_status (id)",
+    "INSERT INTO card_information VALUES (1, 'John Doe', '4012888888881881', '12/25', '123')",
+    "INSERT INTO payment_status VALUES (1, 1, 50.0, 'USD', '200', 'Payment executed succesfully')",
+    "INSERT INTO payment_status VALUES (2, 1, 20.0, 'USD', '200', 'Payment executed succesfully')",
+]
+
+
+class TestMigrateDatabase(unittest.TestCase):
+    def setUp(self):
+        # Create a database with the previous schema
+        self.database_directory = tempfile.TemporaryDirectory()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.database_directory.name, 'test.db')}")
+        with self.engine.begin() as connection:
+            for statement in PREVIOUS_SCHEMA:
+                connection.exec_driver_sql(statement)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.database_directory.cleanup()
+
+    def test_migrate_payment_status(self):
+        migrate_database(self.engine)
+        # Already migrated database is left unchanged
+        migrate_database(self.engine)
+
+        index_names = {index["name"] for index in inspect(self.engine).get_indexes("payment_status")}
+        self.assertEqual(index_names, {"ix_payment_status_id", "ix_payment_status_created_at"})
+
+        with Session(bind=self.engine) as session:
+            payments = session.query(PaymentStatus).order_by(PaymentStatus.id).all()
+            self.assertEqual([payment.amount for payment in payments], [50.0, 20.0])
+            self.assertIsNotNone(payments[0].created_at)
+
+            # Ids of removed payments are not given again
+            session.delete(payments[1])
+            session.commit()
+            payment_status = PaymentStatus(
+                card_id=1, amount=5.0, currency="EUR", status="200", message="Payment executed succesfully"
+            )
+            session.add(payment_status)
+            session.commit()
+            self.assertEqual(payment_status.id, 3)
+
+    def test_migrate_card_information(self):
+        migrate_database(self.engine)
+
+        with Session(bind=self.engine) as session:
+            card_information = session.get(CardInformation, 1)
+            self.assertEqual(card_information.card_number, "4012888888881881")
+            self.assertIsNone(card_information.brand)
+
+
+if __name__ == '__main__':
+    unittest.main()
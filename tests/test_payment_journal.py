@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# ==============================================================
+#                         IMPORTS
+# ==============================================================
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import Mock, patch
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from payment_gateway.database import Base, CardInformation, PaymentStatus
+from payment_gateway.payment_journal import PaymentJournal, RECORD_HEADER, get_payment_journal, record_checksum
+from payment_gateway.process_payment import ProcessPayment
+from payment_gateway.retrieve_payment import RetrievePayment
+
+# ==============================================================
+#                          BASE
+# ==============================================================
+
+# Test Configuration for database
+TEST_DB_URI = 'sqlite:///:memory:'
+
+PAYMENT_RECORD = {
+    "owner_name": "John Doe",
+    "card_number": "4012888888881881",
+    "expiration_date": "12/25",
+    "ccv": "123",
+    "brand": "visa",
+    "amount": 50.0,
+    "currency": "USD",
+    "status": "200",
+    "message": "Payment executed succesfully"
+}
+
+
+class TestPaymentJournal(unittest.TestCase):
+    def setUp(self):
+        # Create a database and a journal directory for tests
+        self.engine = create_engine(TEST_DB_URI)
+        Base.metadata.create_all(self.engine)
+        self.session_factory = sessionmaker(bind=self.engine)
+        self.journal_directory = tempfile.TemporaryDirectory()
+        self.journal = self.open_journal()
+
+    def tearDown(self):
+        # Clean database and journal after each test
+        self.journal.close()
+        Base.metadata.drop_all(self.engine)
+        self.journal_directory.cleanup()
+
+    def open_journal(self, segment_size=4096):
+        return PaymentJournal(self.journal_directory.name, segment_size, self.session_factory)
+
+    def crash_journal(self):
+        """ Simulate a crash: files are closed without applying the journal
+        """
+        os.close(self.journal.fd)
+        os.close(self.journal.lock_fd)
+
+    def count_payments(self):
+        session = self.session_factory()
+        try:
+            return session.query(PaymentStatus).count()
+        finally:
+            session.close()
+
+    def test_append_and_apply(self):
+        first_payment_id = self.journal.append(PAYMENT_RECORD)
+        second_payment_id = self.journal.append(dict(PAYMENT_RECORD, amount=20.0))
+
+        self.assertEqual((first_payment_id, second_payment_id), (1, 2))
+        self.assertEqual(self.count_payments(), 0)
+        self.assertEqual(self.journal.get_pending(2)["amount"], 20.0)
+
+        self.assertEqual(self.journal.apply_pending(), 2)
+
+        session = self.session_factory()
+        payment = session.get(PaymentStatus, 2)
+        self.assertEqual(payment.amount, 20.0)
+        self.assertIsNotNone(payment.created_at)
+        self.assertEqual(session.query(CardInformation).one().brand, "visa")
+        session.close()
+        self.assertIsNone(self.journal.get_pending(2))
+        self.assertEqual(self.journal.apply_pending(), 0)
+
+    def test_replay_after_crash(self):
+        self.journal.append(PAYMENT_RECORD)
+        self.journal.apply_pending()
+        self.journal.append(dict(PAYMENT_RECORD, amount=20.0))
+        self.crash_journal()
+
+        self.journal = self.open_journal()
+
+        self.assertEqual(list(self.journal.pending), [2])
+        self.assertEqual(self.journal.apply_pending(), 1)
+        self.assertEqual(self.count_payments(), 2)
+        self.assertEqual(self.journal.append(PAYMENT_RECORD), 3)
+
+    def test_replay_skips_records_already_applied(self):
+        self.journal.append(PAYMENT_RECORD)
+        self.journal.apply_pending()
+        # Simulate a crash between the database commit and the checkpoint
+        os.remove(os.path.join(self.journal_directory.name, "checkpoint"))
+        self.crash_journal()
+
+        self.journal = self.open_journal()
+
+        self.assertEqual(self.journal.apply_pending(), 1)
+        self.assertEqual(self.count_payments(), 1)
+
+    def test_ids_not_reused_after_archive(self):
+        self.journal.append(PAYMENT_RECORD)
+        self.journal.append(PAYMENT_RECORD)
+        self.journal.apply_pending()
+        # Payments are archived: they are no longer in database
+        session = self.session_factory()
+        session.query(PaymentStatus).delete()
+        session.commit()
+        session.close()
+        self.journal.close()
+
+        self.journal = self.open_journal()
+
+        self.assertEqual(self.journal.append(PAYMENT_RECORD), 3)
+
+    def test_ids_not_reused_after_archive_without_journal(self):
+        self.journal.close()
+        # Payments created without the journal, then archived
+        session = self.session_factory()
+        card_information = CardInformation(
+            owner_name="John Doe", card_number="4012888888881881", expiration_date="12/25", ccv="123"
+        )
+        session.add(card_information)
+        session.flush()
+        for _ in range(3):
+            session.add(PaymentStatus(
+                card_id=card_information.id, amount=10.0, currency="USD",
+                status="200", message="Payment executed succesfully"
+            ))
+        session.commit()
+        session.query(PaymentStatus).delete()
+        session.commit()
+        session.close()
+
+        self.journal = self.open_journal()
+
+        self.assertEqual(self.journal.append(PAYMENT_RECORD), 4)
+
+    def test_replay_with_id_used_by_other_payment(self):
+        self.journal.append(PAYMENT_RECORD)
+        self.journal.apply_pending()
+        os.remove(os.path.join(self.journal_directory.name, "checkpoint"))
+        # Another payment took the id before the replay
+        session = self.session_factory()
+        session.get(PaymentStatus, 1).amount = 99.0
+        session.commit()
+        session.close()
+        self.crash_journal()
+
+        self.journal = self.open_journal()
+
+        self.assertEqual(self.journal.apply_pending(), 1)
+        with open(os.path.join(self.journal_directory.name, "dead_letter.log"), "rb") as dead_letter_file:
+            dead_letters = self.journal.read_records(dead_letter_file.fileno(), 0)
+        self.assertEqual([record["amount"] for record, _ in dead_letters], [50.0])
+
+    def test_same_card_with_other_owner(self):
+        self.journal.append(PAYMENT_RECORD)
+        self.journal.append(dict(PAYMENT_RECORD, owner_name="Jane Doe"))
+        self.journal.append(PAYMENT_RECORD)
+
+        self.assertEqual(self.journal.apply_pending(), 3)
+        self.assertEqual(len(self.journal.pending), 0)
+        self.assertEqual(self.count_payments(), 3)
+
+    def test_failing_record_moved_to_dead_letter(self):
+        apply_record = self.journal.apply_record
+
+        def apply_record_failing_on_second_payment(session, record):
+            if record["payment_id"] == 2:
+                raise IntegrityError("INSERT", {}, Exception("constraint failed"))
+            return apply_record(session, record)
+
+        for _ in range(3):
+            self.journal.append(PAYMENT_RECORD)
+        with patch.object(self.journal, "apply_record", side_effect=apply_record_failing_on_second_payment):
+            self.assertEqual(self.journal.apply_pending(), 3)
+
+        self.assertEqual(len(self.journal.pending), 0)
+        self.assertEqual(self.count_payments(), 2)
+        with open(os.path.join(self.journal_directory.name, "dead_letter.log"), "rb") as dead_letter_file:
+            dead_letters = self.journal.read_records(dead_letter_file.fileno(), 0)
+        self.assertEqual([record["payment_id"] for record, _ in dead_letters], [2])
+
+    def test_torn_write_is_ignored(self):
+        self.journal.append(PAYMENT_RECORD)
+        # Corrupt the end of the record, as an interrupted write would
+        os.pwrite(self.journal.fd, b"\xff", self.journal.write_offset - 1)
+        self.crash_journal()
+
+        self.journal = self.open_journal()
+
+        self.assertEqual(len(self.journal.pending), 0)
+        self.assertEqual(self.journal.write_offset, 0)
+
+    def test_concurrent_appends_share_a_sync(self):
+        appends_count = 8
+        fdatasync = os.fdatasync
+        sync_calls = []
+
+        def slow_first_fdatasync(fd):
+            sync_calls.append(fd)
+            if len(sync_calls) == 1:
+                # Wait for the other appends to be written during the first sync
+                for _ in range(500):
+                    if len(self.journal.pending) == appends_count:
+                        break
+                    threading.Event().wait(0.01)
+            fdatasync(fd)
+
+        with patch("os.fdatasync", side_effect=slow_first_fdatasync):
+            threads = [threading.Thread(target=self.journal.append, args=(PAYMENT_RECORD,))
+                       for _ in range(appends_count)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # First sync made the first record durable, a second one all the others
+        self.assertEqual(len(sync_calls), 2)
+        self.assertEqual(self.journal.apply_pending(), appends_count)
+
+    def test_failed_sync_stops_the_journal(self):
+        with patch("os.fdatasync", side_effect=OSError("I/O error")) as fdatasync:
+            with self.assertRaises(OSError):
+                self.journal.append(PAYMENT_RECORD)
+            with self.assertRaises(RuntimeError):
+                self.journal.append(PAYMENT_RECORD)
+
+        # Sync is not retried and the record is never loaded
+        self.assertEqual(fdatasync.call_count, 1)
+        self.assertEqual(self.journal.apply_pending(), 0)
+
+    def test_journal_directory_locked(self):
+        with self.assertRaises(RuntimeError):
+            self.open_journal()
+
+    def test_unsupported_record_version(self):
+        self.journal.append(PAYMENT_RECORD)
+        # Rewrite the record header with a version this code does not know
+        length, _, _ = RECORD_HEADER.unpack(os.pread(self.journal.fd, RECORD_HEADER.size, 0))
+        body = os.pread(self.journal.fd, length, RECORD_HEADER.size)
+        os.pwrite(self.journal.fd, RECORD_HEADER.pack(length, record_checksum(99, body), 99), 0)
+        self.crash_journal()
+
+        with self.assertRaises(ValueError):
+            self.open_journal()
+
+        # Journal can be opened again once the unreadable segment is removed
+        os.remove(self.journal.segment_path(1))
+        self.journal = self.open_journal()
+
+    def test_segment_rotation(self):
+        self.journal.close()
+        self.journal = self.open_journal(segment_size=200)
+
+        with patch.object(self.journal, "sync_directory", wraps=self.journal.sync_directory) as sync_directory:
+            for _ in range(5):
+                self.journal.append(PAYMENT_RECORD)
+        # Every new segment is durable before its records are acknowledged
+        self.assertEqual(sync_directory.call_count, self.journal.segment_number - 1)
+
+        self.assertGreater(self.journal.segment_number, 1)
+        with patch.object(self.journal, "sync_directory", wraps=self.journal.sync_directory) as sync_directory:
+            self.assertEqual(self.journal.apply_pending(), 5)
+            # New checkpoint is durable
+            sync_directory.assert_called_once_with()
+        self.assertEqual(self.count_payments(), 5)
+        self.assertEqual(len(self.journal.list_segments()), 1)
+
+    def test_pending_payment_retrieved_without_database(self):
+        self.journal.append(PAYMENT_RECORD)
+        db_session = Mock()
+        retrieve_payment = RetrievePayment(db_session)
+        retrieve_payment.journal = self.journal
+
+        self.assertEqual(retrieve_payment.get_payment(1)["payment_id"], 1)
+        # A record applied between a database read and a journal read would not be found
+        db_session.query.assert_not_called()
+
+    @patch('payment_gateway.payment_journal.shared_payment_journal_loaded', False)
+    @patch('payment_gateway.payment_journal.shared_payment_journal', None)
+    @patch('payment_gateway.payment_journal.load_config', return_value={"journal_mode": False})
+    def test_disabled_journal_mode_read_once(self, mock_load_config):
+        self.assertIsNone(get_payment_journal())
+        self.assertIsNone(get_payment_journal())
+
+        mock_load_config.assert_called_once_with()
+
+    @patch('payment_gateway.api_acquiring_bank.APIAcquiringBank.call_acquiring_bank')
+    def test_submit_and_retrieve_payment_in_journal_mode(self, mock_call_acquiring_bank):
+        mock_call_acquiring_bank.return_value = {'code': '200', 'message': 'Payment successful'}
+        db_session = Mock()
+        payment_data = Mock(
+            card_owner="John Doe", card_number="4012888888881881", expiration_date="12/25",
+            ccv="123", amount=50.0, currency="USD"
+        )
+
+        result_process_payment = ProcessPayment(db_session, journal=self.journal).submit_payment(payment_data)
+
+        self.assertEqual(result_process_payment, {"payment_id": 1, "status": "payment successful"})
+        db_session.query.assert_not_called()
+
+        retrieve_payment = RetrievePayment(self.session_factory())
+        retrieve_payment.journal = self.journal
+        retrieved_payment_details = retrieve_payment.get_payment(1)
+        self.assertEqual(retrieved_payment_details["card_number"], '*' * 12 + "1881")
+        self.assertEqual(retrieved_payment_details["status_code"], "200")
+        self.assertEqual(retrieved_payment_details["card_brand"], "visa")
+
+
+if __name__ == '__main__':
+    unittest.main()
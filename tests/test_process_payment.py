@@ -9,6 +9,7 @@ from unittest.mock import Mock, patch
 from fastapi.testclient import TestClient
 from payment_gateway.server import payment_gateway_app
 from payment_gateway.database import CardInformation, PaymentStatus
+from payment_gateway.velocity_check import VelocityCheck
 from sqlalchemy.orm import Session
 from freezegun import freeze_time
 
@@ -20,6 +21,8 @@ from freezegun import freeze_time
 TEST_DB_URI = 'sqlite:///:memory:'
 
 
+# Each test starts with empty velocity counters, instead of the ones of the previous tests
+@patch('payment_gateway.velocity_check.shared_velocity_check', None)
 class TestProcessPayment(unittest.TestCase):
     def setUp(self):
         # Configure FastAPI application for tests
@@ -77,6 +80,33 @@ class TestProcessPayment(unittest.TestCase):
         result_process_payment = response.json()
         self.assertEqual(result_process_payment['status'], 'payment rejected')
 
+    @patch('payment_gateway.api_acquiring_bank.APIAcquiringBank.call_acquiring_bank')
+    @freeze_time("2024-01-25")
+    def test_process_payment_velocity_rejected(self, mock_call_acquiring_bank):
+        valid_payment_data = {
+            "card_owner": "John Doe",
+            "card_number": "4012888888881881",
+            "expiration_date": "12/25",
+            "ccv": "123",
+            "amount": 50,
+            "currency": "USD"
+        }
+        # Velocity check configured to reject any attempt
+        velocity_check = VelocityCheck(
+            window_seconds=60, bucket_seconds=5, max_attempts=0, max_amounts={"default": 10000}, max_cards=10
+        )
+
+        with patch('payment_gateway.process_payment.get_velocity_check', return_value=velocity_check):
+            response = self.client.post('/process_payment', json=valid_payment_data)
+
+        self.assertEqual(response.status_code, 200)
+
+        result_process_payment = response.json()
+        self.assertIsNone(result_process_payment['payment_id'])
+        self.assertEqual(result_process_payment['status'], 'payment rejected')
+        self.assertEqual(result_process_payment['reason'], 'Too many payment attempts with this card')
+        mock_call_acquiring_bank.assert_not_called()
+
     @freeze_time("2024-01-25")
     def test_process_payment_invalid_name(self):
         """ Validate the error message for
@@ -5,7 +5,7 @@
 #                         IMPORTS
 # ==============================================================
 import unittest
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from fastapi.testclient import TestClient
 from payment_gateway.server import payment_gateway_app
 from payment_gateway.database import CardInformation, PaymentStatus
@@ -20,6 +20,8 @@ from freezegun import freeze_time
 TEST_DB_URI = 'sqlite:///:memory:'
 
 
+# Each test starts with empty velocity counters, instead of the ones of the previous tests
+@patch('payment_gateway.velocity_check.shared_velocity_check', None)
 class TestRetrievePayment(unittest.TestCase):
     def setUp(self):
         # Configure FastAPI application for tests
@@ -55,6 +57,8 @@ class TestRetrievePayment(unittest.TestCase):
         retrieved_payment_details = response_retrieve_payment.json()
         self.assertEqual(retrieved_payment_details['payment_id'], payment_id)
         self.assertEqual(retrieved_payment_details['card_number'][:12], '*' * 12)
+        # Brand found in bin_ranges.csv when the payment was processed
+        self.assertEqual(retrieved_payment_details['card_brand'], 'visa')
 
     def test_retrieve_payment_not_found(self):
         response_retrieve_payment = self.client.get('/retrieve_payment?payment_identifier=999')
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# ==============================================================
+#                         IMPORTS
+# ==============================================================
+import unittest
+from unittest.mock import Mock, patch
+from payment_gateway.velocity_check import VelocityCheck
+from payment_gateway.process_payment import ProcessPayment
+
+# ==============================================================
+#                          BASE
+# ==============================================================
+
+
+class FakeClock:
+    """ Clock moved forward manually by the tests
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestVelocityCheck(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.velocity_check = VelocityCheck(
+            window_seconds=60, bucket_seconds=5, max_attempts=3,
+            max_amounts={"default": 100, "JPY": 15000}, max_cards=2, clock=self.clock
+        )
+
+    def payment(self, card_number="4012888888881881", amount=10, currency="USD"):
+        return Mock(card_number=card_number, amount=amount, currency=currency)
+
+    def test_too_many_attempts(self):
+        for _ in range(3):
+            self.assertIsNone(self.velocity_check.check_payment(self.payment()))
+
+        self.assertEqual(
+            self.velocity_check.check_payment(self.payment()),
+            "Too many payment attempts with this card"
+        )
+        # Other cards are not affected
+        self.assertIsNone(self.velocity_check.check_payment(self.payment("8142740445497749")))
+
+    def test_amount_limit(self):
+        self.assertIsNone(self.velocity_check.check_payment(self.payment(amount=60)))
+
+        self.assertEqual(
+            self.velocity_check.check_payment(self.payment(amount=60)),
+            "Payment amount limit reached for this card"
+        )
+
+    def test_rejected_amount_is_not_counted(self):
+        self.assertEqual(
+            self.velocity_check.check_payment(self.payment(amount=500)),
+            "Payment amount limit reached for this card"
+        )
+
+        self.assertIsNone(self.velocity_check.check_payment(self.payment(amount=90)))
+
+    def test_amount_limit_per_currency(self):
+        self.assertIsNone(self.velocity_check.check_payment(self.payment(amount=90, currency="USD")))
+        # Amounts of other currencies are not added to the USD ones
+        self.assertIsNone(self.velocity_check.check_payment(self.payment(amount=90, currency="eur")))
+        self.assertEqual(
+            self.velocity_check.check_payment(self.payment(amount=20, currency="EUR")),
+            "Payment amount limit reached for this card"
+        )
+        # Currency with its own limit
+        self.assertIsNone(self.velocity_check.check_payment(self.payment("1", amount=10000, currency="JPY")))
+
+    def test_sliding_window(self):
+        for _ in range(3):
+            self.velocity_check.check_payment(self.payment())
+            self.clock.now += 20
+
+        # First attempt has left the window
+        self.assertIsNone(self.velocity_check.check_payment(self.payment()))
+
+    def test_idle_and_capacity_eviction(self):
+        self.velocity_check.check_payment(self.payment("1"))
+        self.velocity_check.check_payment(self.payment("2"))
+        self.velocity_check.check_payment(self.payment("3"))
+        self.assertEqual(list(self.velocity_check.cards), ["2", "3"])
+
+        self.clock.now += 61
+        self.velocity_check.check_payment(self.payment("4"))
+        self.assertEqual(list(self.velocity_check.cards), ["4"])
+
+    @patch('payment_gateway.api_acquiring_bank.APIAcquiringBank.call_acquiring_bank')
+    def test_submit_payment_rejected_before_bank(self, mock_call_acquiring_bank):
+        db_session = Mock()
+        process_payment = ProcessPayment(db_session, self.velocity_check)
+        for _ in range(3):
+            self.velocity_check.check_payment(self.payment())
+
+        result_process_payment = process_payment.submit_payment(self.payment())
+
+        self.assertEqual(result_process_payment['status'], 'payment rejected')
+        self.assertEqual(result_process_payment['reason'], 'Too many payment attempts with this card')
+        mock_call_acquiring_bank.assert_not_called()
+        db_session.query.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()